@@ -4,10 +4,70 @@ Each line is matched against each extractor, which is a (stateful) class that ca
 extract a meaningful value from a string line.
 """
 import re
+import array
+import operator
 import os.path
+import multiprocessing
 from withdelta import *
 from datetime import timedelta
 
+# Flags of a pattern compiled without any (inline) flag.
+_DEFAULT_REGEX_FLAGS = re.compile('').flags
+_GROUP_NAME_RGX = re.compile(r'\(\?P([<=])(\w+)')
+_BACKREFERENCE_RGX = re.compile(r'\\[1-9]|\(\?P=|\(\?\(')
+_REGEX_METACHARACTERS = '.^$*+?{}[]\\|()'
+# Types of the raw values that the converters screen with a regex
+_TEXT_TYPES = frozenset([str, type(u'')])
+# Every string accepted by int() has a (Unicode) digit, and by float() a digit or an 'n' of
+# inf/nan. Strings without one are rejected upfront, as raising is expensive.
+_INT_HINT_RGX = re.compile(r'\d', re.UNICODE)
+_FLOAT_HINT_RGX = re.compile(r'\d|n', re.IGNORECASE | re.UNICODE)
+# Memory sizes, with the prefix of the unit in the second group
+_MEMORY_RGX = re.compile(r'\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:e[-+]?\d+)?)\s*([kmg]?)b?\s*$', re.IGNORECASE)
+_MEMORY_FACTORS = {'': 1, 'k': 1000, 'm': 1000000, 'g': 1000000000}
+# Types of the values the footer of a table is computed on
+_FOOTER_TYPES = frozenset([timedelta, float, int])
+
+# 'q' (long long) is missing on Python 2, where 'l' is 64 bit on Unix
+try:
+    array.array('q')
+    _INT64_TYPECODE = 'q'
+except ValueError:
+    _INT64_TYPECODE = 'l'
+
+# Log files are large and read sequentially, fetch them in big blocks
+_READ_BUFFER_SIZE = 1 << 20
+
+# Compiled patterns by source, shared by all the extractors of all the scanned files
+_PATTERN_CACHE = {}
+
+def _compile_cached(rgx_source):
+    """
+    Same as `re.compile`, but each source is compiled only once per process.
+    """
+    regex = _PATTERN_CACHE.get(rgx_source)
+    if regex is None:
+        regex = _PATTERN_CACHE[rgx_source] = re.compile(rgx_source)
+    return regex
+
+def _is_joinable(regex):
+    """
+    True if `regex` can be put into an alternation with other patterns without changing its
+    meaning, i.e. it has no flags and does not refer to its own groups.
+    """
+    return isinstance(regex.pattern, str) and regex.flags == _DEFAULT_REGEX_FLAGS and \
+        _BACKREFERENCE_RGX.search(regex.pattern) is None
+
+def _get_leading_literal(pattern):
+    """
+    Returns the character every string matched by `pattern` starts with, or None if it is not known.
+    """
+    if pattern.startswith('^'):
+        pattern = pattern[1:]
+    if len(pattern) == 0 or '|' in pattern or pattern[0] in _REGEX_METACHARACTERS or pattern[1:2] in ('?', '*', '{'):
+        return None
+    return pattern[0]
+
 class ExtractorBase(object):
     """
     The base class that pulls data out of the log files. Subclasses should implement
@@ -20,7 +80,8 @@ class ExtractorBase(object):
           matches). The operator `+=` is invoked on the value returned by
           `extract_value_from_line`.
         - POLICY_APPEND: all the extracted values are inserted into a list. The
-          `value` property is thus a list.
+          `value` property is thus a list. If `packed_typecode` is not None, an
+          `array.array` with that typecode is used instead.
 
     If no match is found, `value` defaults to None.
     """
@@ -31,7 +92,20 @@ class ExtractorBase(object):
 
     value = None
     num_of_matches = None
-    policy = None
+    packed_typecode = None
+
+    @property
+    def policy(self):
+        return self._policy
+
+    @policy.setter
+    def policy(self, policy):
+        self._policy = policy
+        if policy == ExtractorBase.POLICY_APPEND and self.packed_typecode is not None:
+            self._update = _update_append_packed
+        else:
+            # Unknown policies never update the value after the first match
+            self._update = _POLICY_UPDATES.get(policy, _update_keep_first)
 
     def extract_value_from_line(self, line):
         """
@@ -45,6 +119,13 @@ class ExtractorBase(object):
         """
         pass
 
+    def get_line_regex(self):
+        """
+        Returns a compiled regex that has to `match` a line for `extract_value_from_line` to
+        return something other than None, or None if there is no such regex.
+        """
+        return None
+
     def process_line(self, line):
         """
         Not to be overridden. Calls `extract_value_from_line` and updates `value`
@@ -53,18 +134,7 @@ class ExtractorBase(object):
         candidate = self.extract_value_from_line(line)
         if candidate is not None:
             self.num_of_matches += 1
-            if self.value is None:
-                self.value = candidate if self.policy != ExtractorBase.POLICY_APPEND else [candidate]
-            elif self.policy == ExtractorBase.POLICY_KEEP_FIRST:
-                pass
-            elif self.policy == ExtractorBase.POLICY_KEEP_LAST:
-                self.value = candidate
-            elif self.policy == ExtractorBase.POLICY_SUM:
-                self.value += candidate
-            elif self.policy == ExtractorBase.POLICY_APPEND:
-                self.value += [candidate]
-        else:
-            return None
+            self._update(self, candidate)
 
     def __init__(self, policy='POLICY_KEEP_LAST'):
         super(ExtractorBase, self).__init__()
@@ -72,6 +142,71 @@ class ExtractorBase(object):
         self.policy = policy
         self.value = None
 
+def _update_keep_last(extractor, candidate):
+    extractor.value = candidate
+
+def _update_keep_first(extractor, candidate):
+    if extractor.value is None:
+        extractor.value = candidate
+
+def _update_sum(extractor, candidate):
+    if extractor.value is None:
+        extractor.value = candidate
+    else:
+        extractor.value += candidate
+
+def _update_append(extractor, candidate):
+    if extractor.value is None:
+        extractor.value = [candidate]
+    else:
+        extractor.value.append(candidate)
+
+def _update_append_packed(extractor, candidate):
+    try:
+        if extractor.value is None:
+            extractor.value = array.array(extractor.packed_typecode, [candidate])
+        else:
+            extractor.value.append(candidate)
+    except OverflowError:
+        # Does not fit the array, keep this and the following values in a list
+        extractor.value = [] if extractor.value is None else extractor.value.tolist()
+        extractor.value.append(candidate)
+        extractor._update = _update_append
+
+_POLICY_UPDATES = {
+    ExtractorBase.POLICY_KEEP_LAST: _update_keep_last,
+    ExtractorBase.POLICY_KEEP_FIRST: _update_keep_first,
+    ExtractorBase.POLICY_SUM: _update_sum,
+    ExtractorBase.POLICY_APPEND: _update_append,
+}
+
+def _is_valid_timedelta(val):
+    return val.total_seconds() >= 0.0
+
+def _timedelta_to_float(val):
+    return val.total_seconds()
+
+def _is_valid_int(val):
+    return val >= 0
+
+def _is_valid_float(val):
+    return val == val
+
+def _always_valid(val):
+    return True
+
+def _to_zero(val):
+    return 0.0
+
+# (is_valid, to_float) pairs used by `StatsExtractorBase.get_delta_percent`, by type
+_DELTA_TYPE_DISPATCH = {
+    timedelta: (_is_valid_timedelta, _timedelta_to_float),
+    int: (_is_valid_int, float),
+    str: (_always_valid, _to_zero),
+    type(u''): (_always_valid, _to_zero),
+    float: (_is_valid_float, float),
+}
+
 class RegexExtractor(ExtractorBase):
     """
     Extracts a string value from a line matched by a regular expression. The value
@@ -81,18 +216,33 @@ class RegexExtractor(ExtractorBase):
         `RegexExtractor('^hello\\s+(?P<result>\\w+)')`
         This extractor would match the next non-empty word following a 'hello' string
         at the beginning of the line.
+
+    If `prefilter` is specified, the regex is run only on lines that contain `prefilter`
+    as a substring, which is much cheaper to test (e.g. `prefilter='hello'` above).
     """
     # must have a group named 'result'
     regex = None
+    prefilter = None
 
     def extract_value_from_line(self, line):
+        if self.prefilter is not None and self.prefilter not in line:
+            return None
         match = self.regex.match(line)
         if match is not None:
             return match.groupdict()['result']
 
-    def __init__(self, rgx_source, policy=ExtractorBase.POLICY_KEEP_LAST):
+    def get_line_regex(self):
+        # Only known to hold if `extract_value_from_line` is this one. With a prefilter, the
+        # extractor stays out of the line gates so that the substring test runs first.
+        if self.prefilter is not None or \
+                type(self).extract_value_from_line != RegexExtractor.extract_value_from_line:
+            return None
+        return self.regex
+
+    def __init__(self, rgx_source, policy=ExtractorBase.POLICY_KEEP_LAST, prefilter=None):
         super(RegexExtractor, self).__init__(policy=policy)
-        self.regex = re.compile(rgx_source)
+        self.regex = _compile_cached(rgx_source)
+        self.prefilter = prefilter
 
 class ValueConverterExtractorBase(ExtractorBase):
     """
@@ -103,6 +253,12 @@ class ValueConverterExtractorBase(ExtractorBase):
     def convert_raw_value(self, raw_value):
         return raw_value
 
+    def get_line_regex(self):
+        # Only known to hold if `extract_value_from_line` is this one
+        if type(self).extract_value_from_line != ValueConverterExtractorBase.extract_value_from_line:
+            return None
+        return self._other_extractor.get_line_regex()
+
     def extract_value_from_line(self, line):
         candidate = self._other_extractor.extract_value_from_line(line)
         if candidate is not None:
@@ -110,31 +266,67 @@ class ValueConverterExtractorBase(ExtractorBase):
         else:
             return None
 
+    def _extract_value_from_regex(self, line):
+        # Same as `extract_value_from_line` with the wrapped RegexExtractor inlined
+        if self._prefilter is not None and self._prefilter not in line:
+            return None
+        match = self._regex_match(line)
+        if match is not None:
+            return self.convert_raw_value(match.group('result'))
+
     def __init__(self, other_extractor, policy=ExtractorBase.POLICY_KEEP_LAST):
-        super(ValueConverterExtractorBase, self).__init__(policy=policy)
         assert(isinstance(other_extractor, ExtractorBase))
         self._other_extractor = other_extractor
+        # Regexes matched by the wrapped extractor itself are inlined
+        if type(other_extractor) is RegexExtractor and \
+                type(self).extract_value_from_line == ValueConverterExtractorBase.extract_value_from_line:
+            self._regex_match = other_extractor.regex.match
+            self._prefilter = other_extractor.prefilter
+            self.extract_value_from_line = self._extract_value_from_regex
+        super(ValueConverterExtractorBase, self).__init__(policy=policy)
 
 class IntConverterExtractor(ValueConverterExtractorBase):
     """
     Converts the matched value into int.
+    If `packed` is True and the policy is POLICY_APPEND, the values are stored in an array
+    of 64 bit integers instead of a list. If a value does not fit 64 bits, the values are
+    moved to a list. The footer and the formatters treat arrays as lists.
     """
     def convert_raw_value(self, raw_value):
+        if type(raw_value) in _TEXT_TYPES and _INT_HINT_RGX.search(raw_value) is None:
+            return None
         try:
             return int(raw_value)
         except:
             return None
 
+    def __init__(self, other_extractor, policy=ExtractorBase.POLICY_KEEP_LAST, packed=False):
+        # Must be known before the policy is set
+        self.packed_typecode = _INT64_TYPECODE if packed else None
+        super(IntConverterExtractor, self).__init__(other_extractor, policy=policy)
+
 class FloatConverterExtractor(ValueConverterExtractorBase):
     """
     Converts the matched value into float.
+    If `packed` is True and the policy is POLICY_APPEND, the values are stored in an array
+    of doubles instead of a list. The footer and the formatters treat arrays as lists.
     """
     def convert_raw_value(self, raw_value):
+        if type(raw_value) in _TEXT_TYPES and _FLOAT_HINT_RGX.search(raw_value) is None:
+            return None
         try:
             return float(raw_value)
         except:
             return None
 
+    def __init__(self, other_extractor, policy=ExtractorBase.POLICY_KEEP_LAST, packed=False):
+        # Must be known before the policy is set
+        self.packed_typecode = 'd' if packed else None
+        super(FloatConverterExtractor, self).__init__(other_extractor, policy=policy)
+
+def _dhms_to_seconds(days, hours, minutes, seconds):
+    return ((days * 24.0 + hours) * 60.0 + minutes) * 60.0 + seconds
+
 class TimeConverterExtractor(ValueConverterExtractorBase):
     """
     Converts the matched value in the format `[[[d:]h:]m:]s[.ms]` into a timedelta object.
@@ -149,27 +341,19 @@ class TimeConverterExtractor(ValueConverterExtractorBase):
             return None
         if len(pieces) < 4:
             pieces = [0.0] * (4 - len(pieces)) + pieces
-        return timedelta(days=pieces[0], hours=pieces[1], minutes=pieces[2], seconds=pieces[3])
+        return timedelta(seconds=_dhms_to_seconds(*pieces))
 
 class MemoryConverterExtractor(ValueConverterExtractorBase):
     """
     Parses the suffixes 'K' 'M' 'G' (optionally followed by a 'b') and returns an integer
-    with the correct size in bytes.
+    with the correct size in bytes, or None if the value is not a number.
     """
     def convert_raw_value(self, raw_value):
-        raw_value = raw_value.lower()
-        factor = 1.0
-        if raw_value[-1] == 'b':
-            raw_value = raw_value[:-1]
-        if raw_value[-1] in 'kmg':
-            if raw_value[-1] == 'k':
-                factor = 1000.0
-            elif raw_value[-1] == 'm':
-                factor = 1000000.0
-            else:
-                factor = 1000000000.0
-            raw_value = raw_value[:-1]
-        return int(float(raw_value) * factor)
+        match = _MEMORY_RGX.match(raw_value)
+        if match is None:
+            return None
+        number, prefix = match.groups()
+        return int(float(number) * _MEMORY_FACTORS[prefix.lower()])
 
 class StatsExtractorBase(object):
     """
@@ -199,6 +383,8 @@ class StatsExtractorBase(object):
     return `self.extractors['any_attribute'].value`. If 'any_attribute' is not in `extractors`, but
     it is in `extracted_attributes`, `self.any_attribute` will internally call the method
     `self.get_any_attribute()` and returns its value.
+    Once `scan` is complete, the values of the extractors are stored directly in the instance, so
+    changes to `extractors` made afterwards are not reflected by the attributes anymore.
 
     Data format
     -----------
@@ -210,6 +396,7 @@ class StatsExtractorBase(object):
 
     extractors = {}
     extracted_attributes = []
+    _attribute_getters = {}
 
     @classmethod
     def get_all_extractors(cls):
@@ -234,17 +421,28 @@ class StatsExtractorBase(object):
         pass
 
     def __getattr__(self, name):
-        if name in ['extractors', 'extracted_attributes']:
+        if name in ('extractors', 'extracted_attributes', '_attribute_getters'):
             raise AttributeError('Someone is messing up with __getattr__ or deleted the extracted_attributes/extractors variable...')
-        elif name in self.extractors:
-            return self.extractors[name].value
-        elif name in self.extracted_attributes:
-            if hasattr(self, 'get_' + name):
-                method = getattr(self, 'get_' + name)
-                if hasattr(method, '__call__'):
-                    return method()
+        extractor = self.extractors.get(name)
+        if extractor is not None:
+            return extractor.value
+        getter = self._attribute_getters.get(name)
+        if getter is not None:
+            return getter()
         raise AttributeError('Attribute %s is missing.' % name)
 
+    def _build_attribute_getters(self):
+        """
+        Returns a dictionary that maps each dynamic attribute to its bound `get_*` method.
+        """
+        getters = {}
+        for name in self.extracted_attributes:
+            if name not in self.extractors:
+                getter = getattr(self, 'get_' + name, None)
+                if hasattr(getter, '__call__'):
+                    getters[name] = getter
+        return getters
+
     @classmethod
     def get_delta_percent(cls, val1, val2):
         """
@@ -260,21 +458,10 @@ class StatsExtractorBase(object):
         if type(val1) is not type(val2):
             return None
 
-        if type(val1) is timedelta:
-            is_valid = lambda val : val.total_seconds() >= 0.0
-            to_float = lambda val : val.total_seconds()
-        elif type(val1) is int:
-            is_valid = lambda val : val >= 0
-            to_float = lambda val : float(val)
-        elif type(val1) is str or type(val1) is unicode:
-            is_valid = lambda val : True
-            to_float = lambda val : 0.0
-        elif type(val1) is float:
-            is_valid = lambda val : val == val
-            to_float = lambda val : val
-        else:
-            is_valid = lambda val : False
-            to_float = lambda val : 0.0
+        type_dispatch = _DELTA_TYPE_DISPATCH.get(type(val1))
+        if type_dispatch is None:
+            return float('NaN')
+        is_valid, to_float = type_dispatch
 
         if is_valid(val1) and is_valid(val2):
             if val1 == val2:
@@ -295,34 +482,93 @@ class StatsExtractorBase(object):
             retval[k] = getattr(self, k)
         return retval
 
+    def _build_line_gates(self):
+        """
+        Groups the regex-based extractors by the literal character their pattern starts with, and joins the
+        regexes of each group into a single alternation, which matches a line if and only if at least one
+        of them does. Patterns without a leading literal are grouped under the key None.
+        Returns a tuple (dict of key -> (gate, `process_line` of the gated extractors), `process_line` of the
+        other extractors).
+        """
+        groups, others = {}, []
+        for k in self.extractors:
+            regex = self.extractors[k].get_line_regex()
+            if regex is None or not _is_joinable(regex):
+                others.append(self.extractors[k].process_line)
+            else:
+                groups.setdefault(_get_leading_literal(regex.pattern), []).append((regex, self.extractors[k].process_line))
+        gates = {}
+        for key in groups:
+            # Named groups are made unique, they would clash otherwise (e.g. 'result')
+            patterns = [_GROUP_NAME_RGX.sub(r'(?P\1_%d_\2' % i, regex.pattern) for i, (regex, _) in enumerate(groups[key])]
+            process_fns = tuple([process_fn for _, process_fn in groups[key]])
+            try:
+                gates[key] = (_compile_cached('|'.join(['(?:%s)' % pattern for pattern in patterns])), process_fns)
+            except (re.error, AssertionError): # Python 2 asserts on more than 100 groups
+                others += process_fns
+        return (gates, tuple(others))
+
     def scan(self):
         """
         Parses the file line by line and calls `postprocess` on the extractors, followed by `postprocess_scan`.
+        The regex-based extractors are run only on the lines that start with the right character and match
+        the combined regex of their group.
         """
+        line_gates = self._line_gates
+        ungated_process_fns = self._ungated_process_fns
+        generic_gate = line_gates.get(None)
         for line in self._file_handle:
-            for k in self.extractors:
-                self.extractors[k].process_line(line)
-        for k in self.extractors:
-            self.extractors[k].postprocess()
+            for process_fn in ungated_process_fns:
+                process_fn(line)
+            for gate in (generic_gate, line_gates.get(line[:1])):
+                if gate is not None and gate[0].match(line) is not None:
+                    for process_fn in gate[1]:
+                        process_fn(line)
+        for postprocess_fn in self._postprocess_fns:
+            postprocess_fn()
         self.postprocess_scan()
+        self._materialize()
+
+    def _materialize(self):
+        """
+        Copies the final value of each extractor into the instance, so that reading it as an attribute
+        does not go through `__getattr__` anymore.
+        """
+        for k in self.extractors:
+            if not hasattr(self.__class__, k):
+                self.__dict__[k] = self.extractors[k].value
 
     @classmethod
-    def scan_multiple_runs(cls, files):
+    def scan_run(cls, filename):
+        """
+        Scans a single file and returns the StatsExtractorBase instance, or None if the file does not exist.
+        """
+        if not os.path.isfile(filename):
+            return None
+        print('    Parsing %s...' % filename)
+        with open(filename, 'r', _READ_BUFFER_SIZE) as fh:
+            extractor = cls(fh)
+            extractor.scan()
+        return extractor
+
+    @classmethod
+    def scan_multiple_runs(cls, files, processes=1):
         """
         Scans each file and returns a list of StatsExtractorBase instances.
         If the file does not exists, a None placeholder is placed in the list instead.
+
+        If `processes` is not 1, the files are scanned in parallel by a pool of `processes` worker processes
+        (None means one per CPU). In this case the list contains the output of `as_dict` for each run instead
+        of the instances, which cannot be sent back from the workers, and `cls` must be defined at module level.
         """
-        run_list = []
-        for filename in files:
-            if os.path.isfile(filename):
-                print('    Parsing %s...' % filename)
-                with open(filename, 'r') as fh:
-                    extractor = cls(fh)
-                    extractor.scan()
-                    run_list.append(extractor)
-            else:
-                run_list.append(None)
-        return run_list
+        if processes != 1:
+            pool = multiprocessing.Pool(processes)
+            try:
+                return pool.map(_scan_run_as_dict, [(cls, filename) for filename in files])
+            finally:
+                pool.close()
+                pool.join()
+        return [cls.scan_run(filename) for filename in files]
 
     @classmethod
     def group_multiple_runs(cls, group_by_key, runs):
@@ -337,32 +583,27 @@ class StatsExtractorBase(object):
               non-None value for the key `group_by_key` among all the items of `runs`.
               (i.e. all the runs must have the same `group_by_key` value, or None, otherwise an exception is raised.)
         """
-        all_keys = set()
-        for i in xrange(0, len(runs)):
-            # Make sure there is a dictionary in every entry
-            if runs[i] is None:
-                runs[i] = {}
-            elif isinstance(runs[i], StatsExtractorBase):
-                runs[i] = runs[i].as_dict()
-            all_keys |= set(runs[i].keys())
+        # Make sure there is a dictionary in every entry
+        runs = [{} if run is None else (run.as_dict() if isinstance(run, StatsExtractorBase) else run) for run in runs]
+        all_keys = set().union(*runs)
 
         retval = {}
         for key in all_keys:
             if key == group_by_key:
-                group_by_values = set([run[key] for run in runs if key in run])
-                assert(len(group_by_values) == 1)
-                retval[key] = group_by_values.pop()
+                group_by_values = set([run[key] for run in runs if run.get(key) is not None])
+                assert(len(group_by_values) <= 1)
+                retval[key] = group_by_values.pop() if len(group_by_values) > 0 else None
             else:
-                retval[key] = [None if key not in run else run[key] for run in runs]
+                retval[key] = [run.get(key) for run in runs]
 
         return retval
 
     @classmethod
-    def quick_process_multiple_runs(cls, group_by_key, files):
+    def quick_process_multiple_runs(cls, group_by_key, files, processes=1):
         """
         Alias for scan_multiple_runs --> group_multiple_runs --> add_deltas_to_grouped_runs
         """
-        return cls.add_deltas_to_grouped_runs(cls.group_multiple_runs(group_by_key, cls.scan_multiple_runs(files)))[0]
+        return cls.add_deltas_to_grouped_runs(cls.group_multiple_runs(group_by_key, cls.scan_multiple_runs(files, processes)))[0]
 
     @classmethod
     def add_deltas_to_grouped_runs(cls, *groups):
@@ -382,12 +623,13 @@ class StatsExtractorBase(object):
             key1            key2
             'common_value'  [55, withdelta(3, delta(55, 3)), withdelta(4, delta(55, 4))]
         """
+        get_delta_percent = cls.get_delta_percent
         groups = list(groups)
-        for i in xrange(0, len(groups)):
-            for k in groups[i]:
-                if type(groups[i][k]) is not list: continue
-                ref_val = groups[i][k][0]
-                groups[i][k] = [ref_val] + [withdelta(item, cls.get_delta_percent(ref_val, item)) for item in groups[i][k][1:]]
+        for group in groups:
+            for k, values in group.items():
+                if type(values) is not list: continue
+                ref_val = values[0]
+                group[k] = [ref_val] + [withdelta(item, get_delta_percent(ref_val, item)) for item in values[1:]]
         return groups
 
     @classmethod
@@ -400,46 +642,18 @@ class StatsExtractorBase(object):
         with keys 'max' and 'avg'. The if `with_delta` is specified, deltas for max and avg are computed
         with `add_deltas_to_grouped_runs`.
         """
-        class ExpandBinaryAction(object):
-            def __call__(self, l, r):
-                l, r = val_of(l), val_of(r)
-                if type(l) is not type(r):
-                    return None
-                if type(l) is tuple:
-                    return tuple(self(list(l), list(r)))
-                if type(l) is list:
-                    if len(l) < len(r): l, r = r, l
-                    return [self(l[i], r[i]) for i in xrange(0, len(r))]
-                if type(l) not in self.allowed_types:
-                    return None
-                return self.action(l, r)
-            def __init__(self, action, allowed_types = [timedelta, float, int]):
-                self.action, self.allowed_types = action, allowed_types
-
-        class ExpandUnaryAction(object):
-            def __call__(self, x):
-                x = val_of(x)
-                if type(x) is tuple:
-                    return tuple(self(list(x)))
-                if type(x) is list:
-                    return [self(y) for y in x]
-                if type(x) not in self.allowed_types:
-                    return None
-                return self.action(x)
-            def __init__(self, action, allowed_types = [timedelta, float, int]):
-                self.action, self.allowed_types = action, allowed_types
-
+        count = float(len(groups))
         def divide_value(x):
             if type(x) is timedelta:
-                return timedelta(seconds=x.total_seconds() / float(len(groups)))
+                return timedelta(seconds=x.total_seconds() / count)
             elif type(x) is int:
-                return int(x / float(len(groups)))
+                return int(x / count)
             else:
-                return x / float(len(groups))
+                return x / count
 
-        custom_sum = ExpandBinaryAction(lambda s, t: s + t)
-        custom_max = ExpandBinaryAction(lambda s, t: max(s, t))
-        custom_divide = ExpandUnaryAction(divide_value)
+        custom_sum = _FOOTER_SUM
+        custom_max = _FOOTER_MAX
+        custom_divide = _ExpandUnaryAction(divide_value)
 
         sums = {}
         maxes = {}
@@ -466,5 +680,62 @@ class StatsExtractorBase(object):
         super(StatsExtractorBase, self).__init__()
         self.extracted_attributes = self.__class__.get_all_extracted_attributes()
         self.extractors = self.__class__.get_all_extractors()
+        self._attribute_getters = self._build_attribute_getters()
+        self._line_gates, self._ungated_process_fns = self._build_line_gates()
+        self._postprocess_fns = tuple([self.extractors[k].postprocess for k in self.extractors])
         self._file_handle = file_handle
 
+def _scan_run_as_dict(cls_and_filename):
+    """
+    Worker function for the parallel `StatsExtractorBase.scan_multiple_runs`.
+    """
+    cls, filename = cls_and_filename
+    run = cls.scan_run(filename)
+    return None if run is None else run.as_dict()
+
+class _ExpandBinaryAction(object):
+    """
+    Applies `action` to each pair of corresponding items of two values, recursing into lists and tuples.
+    Packed arrays are treated as lists. Items of mismatched types or types not in `allowed_types` yield None.
+    """
+    def __call__(self, l, r):
+        l, r = val_of(l), val_of(r)
+        value_type = type(l)
+        if value_type is array.array:
+            l, value_type = l.tolist(), list
+        if type(r) is array.array:
+            r = r.tolist()
+        if value_type is not type(r):
+            return None
+        if value_type in self.allowed_types:
+            return self.action(l, r)
+        if value_type is tuple:
+            return tuple(self(list(l), list(r)))
+        if value_type is list:
+            if len(l) < len(r): l, r = r, l
+            return [self(a, b) for a, b in zip(l, r)]
+        return None
+    def __init__(self, action, allowed_types = _FOOTER_TYPES):
+        self.action, self.allowed_types = action, allowed_types
+
+class _ExpandUnaryAction(object):
+    """
+    Unary counterpart of `_ExpandBinaryAction`.
+    """
+    def __call__(self, x):
+        x = val_of(x)
+        value_type = type(x)
+        if value_type is array.array:
+            x, value_type = x.tolist(), list
+        if value_type in self.allowed_types:
+            return self.action(x)
+        if value_type is tuple:
+            return tuple(self(list(x)))
+        if value_type is list:
+            return [self(y) for y in x]
+        return None
+    def __init__(self, action, allowed_types = _FOOTER_TYPES):
+        self.action, self.allowed_types = action, allowed_types
+
+_FOOTER_SUM = _ExpandBinaryAction(operator.add)
+_FOOTER_MAX = _ExpandBinaryAction(max)
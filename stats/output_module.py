@@ -2,17 +2,67 @@
 This module contains classes that format and produce outputs starting from the raw
 scanned data.
 """
-import string, math, cgi
+import string, math, operator, array
 from extractor import StatsExtractorBase
 from withdelta import withdelta, val_of
 from datetime import timedelta
 
+_TEXT_TYPE = type(u'')
+_STRING_TYPES = (str, _TEXT_TYPE)
+
+_HTML_ESCAPE_TABLE = {
+    ord(u'&'): u'&amp;',
+    ord(u'<'): u'&lt;',
+    ord(u'>'): u'&gt;',
+    ord(u'"'): u'&quot;',
+    ord(u"'"): u'&#x27;'
+}
+
+# Plain number types (`long` on Python 2): their text needs no HTML escaping, and their
+# difference is printed in place of an infinite delta
+_NUMBER_TYPES = frozenset([int, float, type(1 << 64)])
+
+_get_value = operator.attrgetter('value')
+_get_delta = operator.attrgetter('delta')
+_WITHDELTA_ONLY = frozenset([withdelta])
+
+# Indentation strings for the HTML output, by depth
+_NUM_INDENTS = 16
+_INDENTS = tuple([' ' * 4 * i for i in range(_NUM_INDENTS)])
+
 def quick_html_escape(txt):
     """
     Performs a full escape of a string into valid HTML code, by
     replacing entities and quotes. Use for sanitizing output.
     """
-    return cgi.escape(unicode(txt), quote=True).encode('ascii', 'xmlcharrefreplace')
+    escaped = _TEXT_TYPE(txt).translate(_HTML_ESCAPE_TABLE).encode('ascii', 'xmlcharrefreplace')
+    return escaped if str is bytes else escaped.decode('ascii')
+
+def _to_str(value):
+    """
+    Same as `str`, except that packed arrays are printed as lists.
+    """
+    return str(value.tolist()) if type(value) is array.array else str(value)
+
+def _classify_delta(delta, bigger_is_better):
+    """
+    Returns success/info/warning/danger for a non-NaN `delta`, where negative deltas are
+    improvements unless `bigger_is_better`.
+    """
+    if bigger_is_better:
+        # Mirrored thresholds: the boundaries are inclusive on the side of the improvement
+        delta = -delta
+    if delta <= -0.05:
+        return 'success'
+    elif delta <= 0.0:
+        return 'info'
+    elif delta <= 0.05:
+        return 'warning'
+    else:
+        return 'danger'
+
+# Contextual text classes for the results of `_classify_delta` and 'muted'
+_TEXT_CLASSES = dict((name, 'text-' + name) for name in ('muted', 'success', 'info', 'warning', 'danger'))
 
 class SimpleConsoleFormatter(object):
     """
@@ -37,6 +87,11 @@ class SimpleConsoleFormatter(object):
     #BOLD = '\033[1m'
     #UNDERLINE = '\033[4m'
 
+    # Padding, then the colored delta
+    _DELTA_FAIL_FMT = '%s' + FAIL + '%s' + ENDC
+    _DELTA_WARNING_FMT = '%s' + WARNING + '%s' + ENDC
+    _DELTA_OKGREEN_FMT = '%s' + OKGREEN + '%s' + ENDC
+
     runs_group = None
 
     key_colw = 4      # width of the key column
@@ -57,15 +112,33 @@ class SimpleConsoleFormatter(object):
         Stores the maximum length of the string representation of each value into
         `value_colw`. Retuns it.
         """
-        for k in self.runs_group:
-            if type(self.runs_group[k]) is list:
-                new_max = max([len(str(val_of(obj))) for obj in self.runs_group[k]])
-            else:
-                new_max = len(str(val_of(self.runs_group[k])))
+        for values in self._get_str_values().values():
+            new_max = max(map(len, values))
             if new_max > self.value_colw:
                 self.value_colw = new_max
         return self.value_colw
 
+    def _compute_widths(self):
+        """
+        Same as `compute_key_len` followed by `compute_value_len`, in a single pass.
+        """
+        key_colw, value_colw = self.key_colw, self.value_colw
+        for k, values in self._get_str_values().items():
+            if len(k) > key_colw:
+                key_colw = len(k)
+            value_colw = max(value_colw, max(map(len, values)))
+        self.key_colw, self.value_colw = key_colw, value_colw
+
+    def _get_str_values(self):
+        """
+        Returns a dictionary mapping each key to the list of the string representations of its values.
+        """
+        if self._str_cache is None:
+            self._str_cache = {}
+            for k, v in self.runs_group.items():
+                self._str_cache[k] = [_to_str(val_of(obj)) for obj in v] if type(v) is list else [_to_str(val_of(v))]
+        return self._str_cache
+
     def _create_header_and_output_format(self):
         def output_header(h, w, l_or_r = 'l'):
             padding = ' ' * (w - len(h))
@@ -79,53 +152,62 @@ class SimpleConsoleFormatter(object):
             self._formatted_header = [output_header('NAME', self.key_colw, 'l'), output_header('VALUE', self.value_colw, 'r')]
         else:
             self._formatted_header = [output_header('NAME', self.key_colw, 'l'), output_header('VALUE0', self.value_colw, 'r')]
-        for i in xrange(1, self._num_of_runs):
+        for i in range(1, self._num_of_runs):
             self._output_line_format += ' {:>' + str(self.value_colw) + '} {}'
             self._formatted_header += [output_header('VALUE' + str(i), self.value_colw, 'r'), output_header('DELTA' + str(i), self.delta_colw, 'r')]
 
     def _generate_formatted_output(self):
+        delta_colw, key_colw = self.delta_colw, self.key_colw
+        # All the paddings needed, indexed by width
+        paddings = tuple([' ' * i for i in range(max(key_colw, self.value_colw, delta_colw) + 1)])
+        no_delta = paddings[delta_colw]
+        nan_delta = paddings[max(delta_colw - 3, 0)] + 'n/a'
+        zero_delta = paddings[max(delta_colw - 1, 0)] + '='
         def output_percent(obj):
             f = None
             if type(obj) is withdelta:
                 f = obj.delta
             if f is None:
-                return self.delta_colw * ' '
+                return no_delta
             elif f != f:
-                return (self.delta_colw - 3) * ' ' + 'n/a'
+                return nan_delta
             elif f == 0.0:
-                return (self.delta_colw - 1) * ' ' + '='
+                return zero_delta
             else:
-                as_string = '{:+0.1%}'.format(f)
-                padding = ' ' * (self.delta_colw - len(as_string))
+                as_string = '%+0.1f%%' % (f * 100.0)
+                padding = delta_colw - len(as_string)
+                padding = paddings[padding] if padding > 0 else ''
                 if f > 0.05:
-                    return padding + SimpleConsoleFormatter.FAIL + as_string + SimpleConsoleFormatter.ENDC
+                    return SimpleConsoleFormatter._DELTA_FAIL_FMT % (padding, as_string)
                 elif f > 0.0:
-                    return padding + SimpleConsoleFormatter.WARNING + as_string + SimpleConsoleFormatter.ENDC
+                    return SimpleConsoleFormatter._DELTA_WARNING_FMT % (padding, as_string)
                 else:
-                    return padding + SimpleConsoleFormatter.OKGREEN + as_string + SimpleConsoleFormatter.ENDC
+                    return SimpleConsoleFormatter._DELTA_OKGREEN_FMT % (padding, as_string)
+        key_prefix, key_suffix = SimpleConsoleFormatter.OKBLUE, SimpleConsoleFormatter.ENDC
+        str_values = self._get_str_values()
         self._formatted_output = []
         for k in self.runs_group:
-            self._formatted_output.append([SimpleConsoleFormatter.OKBLUE + k + SimpleConsoleFormatter.ENDC + ' ' * (self.key_colw - len(k))])
+            line = [''.join((key_prefix, k, key_suffix, paddings[key_colw - len(k)])), str_values[k][0]]
             if type(self.runs_group[k]) is list:
-                self._formatted_output[-1].append(str(val_of(self.runs_group[k][0])))
-                for val in self.runs_group[k][1:]:
-                    self._formatted_output[-1] += [str(val_of(val)), output_percent(val)]
-            else:
-                self._formatted_output[-1].append(str(val_of(self.runs_group[k])))
+                for val, as_string in zip(self.runs_group[k][1:], str_values[k][1:]):
+                    line += [as_string, output_percent(val)]
+            self._formatted_output.append(line)
 
     def run(self):
         """
         Prints to console the output.
         """
         if self._formatted_output is None:
-            self.compute_key_len()
-            self.compute_value_len()
+            self._compute_widths()
             self._create_header_and_output_format()
             self._generate_formatted_output()
+            self._output_block = None
 
-        print(' '.join(self._formatted_header))
-        for line in self._formatted_output:
-            print(self._output_line_format.format(*line))
+        if self._output_block is None:
+            output_line_format = self._output_line_format
+            self._output_block = '\n'.join([' '.join(self._formatted_header)] +
+                                            [output_line_format.format(*line) for line in self._formatted_output])
+        print(self._output_block)
 
     def __init__(self, runs_group):
         super(SimpleConsoleFormatter, self).__init__()
@@ -134,6 +216,15 @@ class SimpleConsoleFormatter(object):
         self._output_line_format = '<call _create_header_and_output_format>'
         self._formatted_header = ['<call _create_header_and_output_format>']
         self._formatted_output = None
+        self._output_block = None
+        self._str_cache = None
+
+def _is_inherited_method(obj, name, cls):
+    """
+    True if `obj.name` is the method defined in `cls`, i.e. it is overridden neither by the class of `obj`
+    nor on `obj` itself.
+    """
+    return getattr(getattr(obj, name), '__func__', None) is cls.__dict__[name]
 
 class TableFormatterBase(object):
     """
@@ -161,14 +252,14 @@ class TableFormatterBase(object):
 
                 begin_group                     -n_group, num_of_runs_in_group
                     begin_row                   +n_run
-                        begin_col               +value, delta, num_of_runs_in_cell, col_has_delta, n_col, col_name
+                        begin_col               +value, delta, num_of_runs_in_cell, in_row_span, col_has_delta, n_col, col_name
                             begin_value         +loc_in_cell(LOC_IN_CELL_VALUE)
                                 process_value
                             end_value
                             begin_delta         +loc_in_cell(LOC_IN_CELL_DELTA)
                                 process_delta
                             end_delta           -loc_in_cell
-                        end_col                 -n_col, col_name, col_has_delta, value
+                        end_col                 -n_col, col_name, col_has_delta, value, in_row_span
                     end_row                     -n_run
                 end_group                       -n_group, num_of_runs_in_group
 
@@ -202,6 +293,8 @@ class TableFormatterBase(object):
     class Location(object):
         """
         State object updated while printing the table.
+        `in_row_span` is True for the cells after the first run of a group, in a column
+        that has no runs (i.e. it holds one value for the whole group).
         """
         LOC_IN_CELL_VALUE = 'LOC_IN_CELL_VALUE'
         LOC_IN_CELL_DELTA = 'LOC_IN_CELL_DELTA'
@@ -209,23 +302,29 @@ class TableFormatterBase(object):
         LOC_IN_TABLE_BODY = 'LOC_IN_TABLE_BODY'
         LOC_IN_TABLE_FOOTER = 'LOC_IN_TABLE_FOOTER'
 
-        loc_in_table = None
-        n_group = -1
-        n_col = -1
-        col_name = None
-        n_run = -1
-        num_of_runs_in_cell = -1
-        num_of_runs_in_group = -1
-        value = None
-        delta = None
-        loc_in_cell = None
-        col_has_delta = None
+        __slots__ = ('loc_in_table', 'n_group', 'n_col', 'col_name', 'n_run', 'num_of_runs_in_cell',
+                     'num_of_runs_in_group', 'value', 'delta', 'loc_in_cell', 'col_has_delta', 'in_row_span')
 
         def update(self, **kwargs):
             for k in kwargs:
                 setattr(self, k, kwargs[k])
             return self
 
+        def __init__(self):
+            super(TableFormatterBase.Location, self).__init__()
+            self.loc_in_table = None
+            self.n_group = -1
+            self.n_col = -1
+            self.col_name = None
+            self.n_run = -1
+            self.num_of_runs_in_cell = -1
+            self.num_of_runs_in_group = -1
+            self.value = None
+            self.delta = None
+            self.loc_in_cell = None
+            self.col_has_delta = None
+            self.in_row_span = False
+
     table = None
     footer = None
     header = None
@@ -243,6 +342,29 @@ class TableFormatterBase(object):
         """
         return self._col_has_delta[col_name]
 
+    def _cache_column_info(self):
+        """
+        Called by `run` once the header is known, stores whatever per-column information
+        is needed while printing the table.
+        """
+        self._col_has_delta_cache = dict((col_name, self.column_has_delta(col_name)) for col_name in self.header)
+
+    def _get_active_hooks(self, *names):
+        """
+        Returns a tuple with the hooks among `names` that override the (no-op) ones of
+        TableFormatterBase, either in a subclass or on the instance.
+        """
+        return tuple([getattr(self, name) for name in names
+                      if not _is_inherited_method(self, name, TableFormatterBase)])
+
+    def _get_cell_hooks(self, loc_in_table):
+        """
+        Returns a tuple (value_hooks, delta_hooks) with the active hooks called on each cell of the
+        given section of the table. Subclasses may return versions specialized for the section.
+        """
+        return (self._get_active_hooks('begin_value', 'process_value', 'end_value'),
+                self._get_active_hooks('begin_delta', 'process_delta', 'end_delta'))
+
     def begin_table(self, loc):
         return None
     def begin_header(self, loc):
@@ -286,124 +408,165 @@ class TableFormatterBase(object):
 
     def run(self):
         self.header = self.recompute_header(self._all_keys)
+        self._cache_column_info()
+        output = [line for line in self._generate_lines() if line is not None]
+        # Every line is terminated by a newline
+        output.append('')
+        self._output = '\n'.join(output)
+        return self._output
 
-        self._output = ''
-        def append(val):
-            if val is None: return
-            self._output += val + '\n'
-
+    def _generate_lines(self):
+        """
+        Walks the table calling the hooks, and yields whatever they return (including None).
+        """
+        col_has_delta = self._col_has_delta_cache
+        header = self.header
         loc = self.__class__.Location()
-        append(self.begin_table(loc))
-        append(self.begin_header(loc.update(loc_in_table=loc.LOC_IN_TABLE_HDR)))
-        append(self.begin_row(loc))
-        for n_col in xrange(0, len(self.header)):
-            append(self.begin_col(loc.update(
-                value=self.header[n_col],
-                n_col=n_col,
-                col_has_delta=self.column_has_delta(self.header[n_col]),
-                col_name=self.header[n_col]
-            )))
-            append(self.begin_value(loc.update(loc_in_cell=loc.LOC_IN_CELL_VALUE)))
-            append(self.process_value(loc))
-            append(self.end_value(loc))
-            append(self.begin_delta(loc.update(loc_in_cell=loc.LOC_IN_CELL_DELTA)))
-            append(self.process_delta(loc))
-            append(self.end_delta(loc))
-            append(self.end_col(loc.update(loc_in_cell=None)))
-        append(self.end_row(loc.update(
-            value=None,
-            n_col=-1,
-            col_has_delta=None,
-            col_name=None,
-        )))
-        append(self.end_header(loc))
-        append(self.begin_body(loc.update(loc_in_table=loc.LOC_IN_TABLE_BODY)))
-
-        def process_groups(groups, group_offset = 0):
-            for n_group in xrange(0, len(groups)):
-                runs_in_group = self._num_of_runs_in_group[n_group + group_offset]
-                append(self.begin_group(loc.update(
-                    n_group=n_group,
-                    num_of_runs_in_group=runs_in_group
-                )))
-                for n_run in xrange(0, runs_in_group):
-                    append(self.begin_row(loc.update(n_run=n_run)))
-                    for n_col in xrange(0, len(self.header)):
-                        # account for missing columns
-                        col_name = self.header[n_col]
-                        runs_in_cell = -1
-                        value = None
-                        delta = None
-                        if col_name in groups[n_group]:
-                            runs_in_cell = self._num_of_runs_in_cell[n_group][col_name]
-                            if runs_in_cell > 0:
-                                value = groups[n_group][col_name][n_run]
-                            else:
-                                value = groups[n_group][col_name]
-                            delta = value.delta if isinstance(value, withdelta) else None
-                            value = val_of(value)
-
-                        append(self.begin_col(loc.update(
-                            value=value,
-                            delta=delta,
-                            num_of_runs_in_cell=runs_in_cell,
-                            col_has_delta=self.column_has_delta(col_name),
-                            n_col=n_col,
-                            col_name=col_name
-                        )))
-                        append(self.begin_value(loc.update(loc_in_cell=loc.LOC_IN_CELL_VALUE)))
-                        append(self.process_value(loc))
-                        append(self.end_value(loc))
-                        append(self.begin_delta(loc.update(loc_in_cell=loc.LOC_IN_CELL_DELTA)))
-                        append(self.process_delta(loc))
-                        append(self.end_delta(loc))
-                        append(self.end_col(loc.update(loc_in_cell=None)))
-
-                    append(self.end_row(loc.update(
-                        value=None,
-                        delta=None,
-                        num_of_runs_in_cell=-1,
-                        col_has_delta=None,
-                        n_col=-1,
-                        col_name=None
-                    )))
-                append(self.end_group(loc.update(n_run=-1)))
-
-        process_groups(self.table)
-        append(self.end_body(loc.update(n_group=-1, num_of_runs_in_group=-1)))
-        append(self.begin_footer(loc.update(loc_in_table=loc.LOC_IN_TABLE_FOOTER)))
-        process_groups(self.footer, len(self.table))
-        append(self.end_footer(loc.update(n_group=-1, num_of_runs_in_group=-1)))
-        append(self.end_table(loc.update(loc_in_table=None)))
-        return self._output
+        LOC_IN_CELL_VALUE, LOC_IN_CELL_DELTA = loc.LOC_IN_CELL_VALUE, loc.LOC_IN_CELL_DELTA
+        # Hooks that are not overridden always return None, do not call them at all
+        begin_group_hooks = self._get_active_hooks('begin_group')
+        end_group_hooks = self._get_active_hooks('end_group')
+        begin_row_hooks = self._get_active_hooks('begin_row')
+        end_row_hooks = self._get_active_hooks('end_row')
+        begin_col_hooks = self._get_active_hooks('begin_col')
+        end_col_hooks = self._get_active_hooks('end_col')
+        yield self.begin_table(loc)
+        loc.loc_in_table = loc.LOC_IN_TABLE_HDR
+        value_hooks, delta_hooks = self._get_cell_hooks(loc.LOC_IN_TABLE_HDR)
+        yield self.begin_header(loc)
+        for hook in begin_row_hooks: yield hook(loc)
+        for n_col, col_name in enumerate(header):
+            loc.value = col_name
+            loc.n_col = n_col
+            loc.col_has_delta = col_has_delta[col_name]
+            loc.col_name = col_name
+            for hook in begin_col_hooks: yield hook(loc)
+            loc.loc_in_cell = LOC_IN_CELL_VALUE
+            for hook in value_hooks: yield hook(loc)
+            loc.loc_in_cell = LOC_IN_CELL_DELTA
+            for hook in delta_hooks: yield hook(loc)
+            loc.loc_in_cell = None
+            for hook in end_col_hooks: yield hook(loc)
+        loc.value = None
+        loc.n_col = -1
+        loc.col_has_delta = None
+        loc.col_name = None
+        for hook in end_row_hooks: yield hook(loc)
+        yield self.end_header(loc)
+        all_runs_in_group = self._num_of_runs_in_group
+        all_runs_in_cell = self._num_of_runs_in_cell
+        split_group_columns = self._split_group_columns
+        # The footer groups follow the body ones in the per-group caches
+        sections = ((loc.LOC_IN_TABLE_BODY, self.begin_body, self.end_body, self.table, 0),
+                    (loc.LOC_IN_TABLE_FOOTER, self.begin_footer, self.end_footer, self.footer, len(self.table)))
+        for loc_in_table, begin_section, end_section, groups, group_offset in sections:
+            loc.loc_in_table = loc_in_table
+            value_hooks, delta_hooks = self._get_cell_hooks(loc_in_table)
+            yield begin_section(loc)
+            for n_group, group in enumerate(groups):
+                runs_in_group = all_runs_in_group[n_group + group_offset]
+                num_of_runs_in_cell = all_runs_in_cell[n_group + group_offset]
+                loc.n_group = n_group
+                loc.num_of_runs_in_group = runs_in_group
+                for hook in begin_group_hooks: yield hook(loc)
+                columns = split_group_columns(group, num_of_runs_in_cell, runs_in_group) if runs_in_group > 0 else None
+                for n_run in range(0, runs_in_group):
+                    loc.n_run = n_run
+                    for hook in begin_row_hooks: yield hook(loc)
+                    for n_col, col_name in enumerate(header):
+                        runs_in_cell, values, deltas = columns[n_col]
+                        loc.value = values[n_run]
+                        loc.delta = deltas[n_run]
+                        loc.num_of_runs_in_cell = runs_in_cell
+                        # runs_in_group is positive here
+                        loc.in_row_span = runs_in_cell <= 0 and n_run > 0
+                        loc.col_has_delta = col_has_delta[col_name]
+                        loc.n_col = n_col
+                        loc.col_name = col_name
+                        for hook in begin_col_hooks: yield hook(loc)
+                        loc.loc_in_cell = LOC_IN_CELL_VALUE
+                        for hook in value_hooks: yield hook(loc)
+                        loc.loc_in_cell = LOC_IN_CELL_DELTA
+                        for hook in delta_hooks: yield hook(loc)
+                        loc.loc_in_cell = None
+                        for hook in end_col_hooks: yield hook(loc)
+
+                    loc.value = None
+                    loc.delta = None
+                    loc.num_of_runs_in_cell = -1
+                    loc.in_row_span = False
+                    loc.col_has_delta = None
+                    loc.n_col = -1
+                    loc.col_name = None
+                    for hook in end_row_hooks: yield hook(loc)
+                loc.n_run = -1
+                for hook in end_group_hooks: yield hook(loc)
+            loc.n_group = -1
+            loc.num_of_runs_in_group = -1
+            yield end_section(loc)
+        loc.loc_in_table = None
+        yield self.end_table(loc)
+
+    def _split_group_columns(self, group, num_of_runs_in_cell, runs_in_group):
+        """
+        Returns, for each column in the header, a tuple (runs_in_cell, values, deltas) where `values`
+        and `deltas` are lists indexed by run, with the withdelta wrappers removed. Values without runs
+        are repeated for every run of the group, missing columns are filled with None.
+        """
+        columns = []
+        append = columns.append
+        for col_name in self.header:
+            if col_name not in group:
+                # account for missing columns
+                append((-1, [None] * runs_in_group, [None] * runs_in_group))
+                continue
+            runs_in_cell = num_of_runs_in_cell[col_name]
+            cell = group[col_name] if runs_in_cell > 0 else [group[col_name]] * runs_in_group
+            head, tail = cell[:1], cell[1:]
+            if len(head) > 0 and head[0].__class__ is not withdelta and _WITHDELTA_ONLY.issuperset(map(type, tail)):
+                # Layout produced by `add_deltas_to_grouped_runs`, a plain reference value followed by withdelta
+                append((runs_in_cell, head + list(map(_get_value, tail)), [None] + list(map(_get_delta, tail))))
+                continue
+            values = [item.value if item.__class__ is withdelta else item for item in cell]
+            deltas = [item.delta if item.__class__ is withdelta else None for item in cell]
+            append((runs_in_cell, values, deltas))
+        return columns
 
     def _get_extra_info(self):
         self._all_keys = set()
         self._col_has_delta = {}
         self._num_of_runs_in_group = []
         self._num_of_runs_in_cell = []
+        col_has_delta = self._col_has_delta
+        append_runs_in_cell = self._num_of_runs_in_cell.append
+        append_runs_in_group = self._num_of_runs_in_group.append
         for group in self.table + self.footer:
-            self._all_keys |= set(group.keys())
-            self._num_of_runs_in_cell.append({})
-            self._num_of_runs_in_group.append(-1)
-            for k in group:
-                if not k in self._col_has_delta:
-                    self._col_has_delta[k] = False
-                if type(group[k]) is list:
-                    for val in group[k]:
-                        if isinstance(val, withdelta):
-                            self._col_has_delta[k] = True
-                            break
-                runs_in_cell = len(group[k]) if type(group[k]) is list else -1
-                self._num_of_runs_in_cell[-1][k] = runs_in_cell
-                if runs_in_cell > self._num_of_runs_in_group[-1]:
-                    self._num_of_runs_in_group[-1] = runs_in_cell
+            self._all_keys.update(group)
+            num_of_runs_in_cell = {}
+            num_of_runs_in_group = -1
+            for k, cell in group.items():
+                runs_in_cell = -1
+                if cell.__class__ is list:
+                    runs_in_cell = len(cell)
+                    if not col_has_delta.get(k, False):
+                        col_has_delta[k] = False
+                        for val in cell:
+                            if val.__class__ is withdelta:
+                                col_has_delta[k] = True
+                                break
+                else:
+                    col_has_delta.setdefault(k, False)
+                num_of_runs_in_cell[k] = runs_in_cell
+                if runs_in_cell > num_of_runs_in_group:
+                    num_of_runs_in_group = runs_in_cell
+            append_runs_in_cell(num_of_runs_in_cell)
+            append_runs_in_group(num_of_runs_in_group)
 
     def __init__(self, grouped_runs, footer_with_delta=True):
         super(TableFormatterBase, self).__init__()
         self.table = grouped_runs
         candidate_footer = StatsExtractorBase.compute_footer_from_grouped_runs(grouped_runs, with_delta=footer_with_delta)
-        self.footer_names = candidate_footer.keys()
+        self.footer_names = list(candidate_footer.keys())
         self.footer = [candidate_footer[k] for k in self.footer_names]
         self._get_extra_info()
 
@@ -481,10 +644,7 @@ class TagBuilder(object):
     """
     Helper class for storing tag attributes and converting them properly to strings.
     """
-    tag_name = 'span'
-    attributes = {}
-    classes = []
-    body = None
+    __slots__ = ('tag_name', 'attributes', 'classes', 'body')
 
     def preprocess(self):
         if self.classes is not None and len(self.classes) > 0:
@@ -494,15 +654,25 @@ class TagBuilder(object):
 
     def run(self):
         self.preprocess()
-        opening = '<%s' % self.tag_name
         if len(self.attributes) > 0:
-            opening += ' ' + ' '.join(['%s="%s"' % (k, quick_html_escape(self.attributes[k])) for k in self.attributes])
-        opening += '>'
+            parts = ['<', self.tag_name]
+            for k in self.attributes:
+                parts += (' ', k, '="', quick_html_escape(self.attributes[k]), '"')
+            parts.append('>')
+            opening = ''.join(parts)
+        else:
+            opening = '<%s>' % self.tag_name
         closing = '</%s>' % self.tag_name
         return (opening, quick_html_escape(self.body) if self.body is not None else None, closing)
 
     @classmethod
     def create_tag(cls, tag_name, classes=[], body=None, **extra_attribs):
+        if not classes and not extra_attribs:
+            # Plain tag, no need for a builder
+            if body is not None:
+                return '<%s>%s</%s>' % (tag_name, quick_html_escape(body), tag_name)
+            else:
+                return '<%s>' % tag_name
         builder = cls(tag_name)
         builder.attributes = extra_attribs
         builder.classes = classes
@@ -520,6 +690,24 @@ class TagBuilder(object):
         self.classes = []
         self.body = None
 
+_LOC_IN_TABLE_HDR = TableFormatterBase.Location.LOC_IN_TABLE_HDR
+_LOC_IN_TABLE_BODY = TableFormatterBase.Location.LOC_IN_TABLE_BODY
+_LOC_IN_TABLE_FOOTER = TableFormatterBase.Location.LOC_IN_TABLE_FOOTER
+
+def _create_delta_td_opening(stand_out, stand_out_class):
+    classes = ['delta']
+    if stand_out:
+        classes.append('stand-out')
+        if stand_out_class is not None:
+            classes.append(stand_out_class)
+    return TagBuilder.create_tag('td', classes)
+
+# Opening <td> tags of the delta cells, by (stand_out, stand_out_class), where the stand out class
+# is None for 'muted' cells. Filled in advance for the classes of `_classify_delta`.
+_delta_td_openings = dict(((stand_out, stand_out_class), _create_delta_td_opening(stand_out, stand_out_class))
+                          for stand_out, stand_out_class in [(False, None), (True, None)] +
+                          [(True, name) for name in ('success', 'info', 'warning', 'danger')])
+
 class HTMLSheetFormatter(TableFilteredBase):
     """
     Produces an HTML5 table with Bootstrap contextual classes.
@@ -544,10 +732,15 @@ class HTMLSheetFormatter(TableFilteredBase):
     Optionally, the user can provide a formatter function as the column descriptor attribute 'formatter'
     to customize the output.
     See the module `formatters.py`.
+    If the formatter only ever produces text that needs no HTML escaping, set the attribute
+    'safe_formatter' to True and the formatted values are printed as they are.
     """
     title = 'HTMLSheetFormatter'
     run_names = []
 
+    _default_template = None
+    _page_format = None
+
 
     @classmethod
     def get_default_column_descriptor(cls):
@@ -555,12 +748,34 @@ class HTMLSheetFormatter(TableFilteredBase):
         sup.update({
             'stand_out': False,
             'formatter': None,
+            'safe_formatter': False,
             'bigger_is_better': False
         })
         return sup
 
     @classmethod
     def get_default_template(cls):
+        # Cached per class, subclasses may override `_create_default_template`
+        template = cls.__dict__.get('_default_template')
+        if template is None:
+            template = cls._default_template = cls._create_default_template()
+        return template
+
+    @classmethod
+    def _get_page_format(cls):
+        """
+        Returns the default template converted to a %-format string with the placeholders
+        %(title)s, %(run_names)s and %(table)s. Cached per class.
+        """
+        page_format = cls.__dict__.get('_page_format')
+        if page_format is None:
+            escaped = string.Template(cls.get_default_template().template.replace('%', '%%'))
+            page_format = cls._page_format = escaped.safe_substitute(dict(
+                (key, '%%(%s)s' % key) for key in ('title', 'run_names', 'table')))
+        return page_format
+
+    @classmethod
+    def _create_default_template(cls):
         return string.Template('''
 <!DOCTYPE html>
 <html>
@@ -642,58 +857,54 @@ $table
         return self.decrease_indent() + '</ol>'
 
     def run(self):
-        run_names = '    n/a' # :)
+        self._runs_output = '    n/a' # :)
         if self.run_names is not None and len(self.run_names) > 0:
             self._indent = 1
-            self._runs_output = ''
+            runs_output = []
             def append(line):
                 if line is not None:
-                    self._runs_output += line + '\n'
+                    runs_output.append(line)
             append(self.begin_runs())
-            for i in xrange(0, len(self.run_names)):
-                append(self.process_run(i, self.run_names[i]))
+            for i, run_name in enumerate(self.run_names):
+                append(self.process_run(i, run_name))
             append(self.end_runs())
+            # Every line is terminated by a newline
+            runs_output.append('')
+            self._runs_output = '\n'.join(runs_output)
             self._indent = 0
-        return self.__class__.get_default_template().substitute({
+        self._stand_out_class_cache = {}
+        return self.__class__._get_page_format() % {
             'run_names': self._runs_output,
             'title': quick_html_escape(self.title),
             'table': super(HTMLSheetFormatter, self).run()
-        })
+        }
 
     def cell_is_th(self, loc):
         """
         True if the cell is a TH, false o/w. Returns True for headers and first column, if it ha no runs.
         """
-        return loc.loc_in_table == loc.LOC_IN_TABLE_HDR or (loc.num_of_runs_in_cell <= 0 and loc.n_col == 0)
+        return loc.loc_in_table == _LOC_IN_TABLE_HDR or (loc.num_of_runs_in_cell <= 0 and loc.n_col == 0)
 
     def get_stand_out_class(self, loc):
         """
         Returns muted/warning/info/danger/success accordnig to the value of `loc.delta` and the column
         attribute 'bigger_is_better'.
         """
-        if loc.delta is None:
+        delta = loc.delta
+        if delta is None:
             return 'muted'
-        elif loc.delta != loc.delta:
+        elif delta != delta:
             return None
         else:
-            if self.get_column_attribute(loc.col_name, 'bigger_is_better', False):
-                if loc.delta < -0.05:
-                    return 'danger'
-                elif loc.delta < 0.0:
-                    return 'warning'
-                elif loc.delta < 0.05:
-                    return 'info'
-                else:
-                    return 'success'
-            else:
-                if loc.delta <= -0.05:
-                    return 'success'
-                elif loc.delta <= 0.0:
-                    return 'info'
-                elif loc.delta <= 0.05:
-                    return 'warning'
-                else:
-                    return 'danger'
+            return _classify_delta(delta, self._col_bigger_is_better[loc.col_name])
+
+    def _get_base_value(self, loc):
+        """
+        Returns the value of the first run in the current group and column, or None.
+        """
+        groups = self.footer if loc.loc_in_table == _LOC_IN_TABLE_FOOTER else self.table
+        cell = groups[loc.n_group].get(loc.col_name)
+        return val_of(cell[0]) if type(cell) is list and len(cell) > 0 else None
 
     def get_delta_text_and_classes(self, loc):
         """
@@ -701,29 +912,37 @@ $table
         and the contextual classes to be applied to the <small> tag.
         """
         as_string = None
-        if loc.delta is None:
+        delta = loc.delta
+        if delta is None:
             as_string = 'n/a'
-        elif loc.delta != loc.delta:
+        elif delta != delta:
             as_string = None
-        elif math.isinf(loc.delta):
-            try:
-                # retrieve the base value
-                this_value = loc.value
-                base_value = self.table[loc.n_group][loc.col_name][0]
+        elif math.isinf(delta):
+            # Show the absolute difference from the base value, when it can be computed
+            this_value = loc.value
+            base_value = self._get_base_value(loc)
+            if type(this_value) in _NUMBER_TYPES and type(base_value) in _NUMBER_TYPES:
                 this_value -= base_value
                 as_string = str(this_value)
                 if this_value >= 0.0:
                     as_string = '+' + as_string
-            except:
-                as_string = '+INF' if loc.delta >= 0.0 else '-INF'
+            else:
+                as_string = '+INF' if delta >= 0.0 else '-INF'
         else:
-            as_string = '{:+0.1%}'.format(loc.delta)
+            as_string = '{:+0.1%}'.format(delta)
 
-        stand_out_class = self._get_stand_out_class_from_cache(loc)
+        if self._col_stand_out[loc.col_name]:
+            stand_out_class = self._get_stand_out_class_from_cache(loc)
+        else:
+            # Only stand out cells are classified more than once, by the value and delta hooks
+            stand_out_class = self.get_stand_out_class(loc)
         if stand_out_class is None:
             return (as_string, None)
-        else:
-            return (as_string, ['text-' + self._get_stand_out_class_from_cache(loc)])
+        text_class = _TEXT_CLASSES.get(stand_out_class)
+        if text_class is None:
+            text_class = 'text-' + stand_out_class
+        # A new list every time, the caller may extend it
+        return (as_string, [text_class])
 
     def begin_table(self, loc):
         return self.increase_indent() + '<table class="table table-condensed table-striped">'
@@ -741,49 +960,52 @@ $table
         return self.decrease_indent() + '</tfoot>'
 
     def begin_group(self, loc):
-        if loc.loc_in_table != loc.LOC_IN_TABLE_BODY:
+        if loc.loc_in_table != _LOC_IN_TABLE_BODY:
             return None
         return self.increase_indent() + '<tbody>'
     def end_group(self, loc):
-        if loc.loc_in_table != loc.LOC_IN_TABLE_BODY:
+        if loc.loc_in_table != _LOC_IN_TABLE_BODY:
             return None
         return self.decrease_indent() + '</tbody>'
 
     def begin_row(self, loc):
-        if loc.loc_in_table == loc.LOC_IN_TABLE_FOOTER and loc.n_run == 0:
+        if loc.loc_in_table == _LOC_IN_TABLE_FOOTER and loc.n_run == 0:
             return self.increase_indent() + '<tr class="as-tbody">'
         return self.increase_indent() + '<tr>'
     def end_row(self, loc):
         return self.decrease_indent() + '</tr>'
 
     def begin_value(self, loc):
+        loc_in_table = loc.loc_in_table
+        col_has_delta = loc.col_has_delta
         builder = TagBuilder('td')
 
         if self.cell_is_th(loc):
             builder.tag_name = 'th'
-            if loc.loc_in_table == loc.LOC_IN_TABLE_FOOTER:
+            if loc_in_table == _LOC_IN_TABLE_FOOTER:
                 builder.classes.append('text-muted')
                 builder.classes.append('text-center')
-            elif loc.loc_in_table == loc.LOC_IN_TABLE_HDR:
+            elif loc_in_table == _LOC_IN_TABLE_HDR:
                 builder.classes.append('text-center')
         else:
             builder.classes.append('text-right')
 
-        if loc.loc_in_table == loc.LOC_IN_TABLE_HDR:
-            if self.column_has_delta(loc.col_name):
+        if loc_in_table == _LOC_IN_TABLE_HDR:
+            if col_has_delta:
                 builder.attributes['colspan'] = 2
 
-        if loc.num_of_runs_in_cell <= 0 and loc.num_of_runs_in_group > 0:
+        num_of_runs_in_group = loc.num_of_runs_in_group
+        if loc.num_of_runs_in_cell <= 0 and num_of_runs_in_group > 0:
             if loc.n_run == 0:
-                builder.attributes['rowspan'] = loc.num_of_runs_in_group
-                if self.column_has_delta(loc.col_name):
+                builder.attributes['rowspan'] = num_of_runs_in_group
+                if col_has_delta:
                     builder.attributes['colspan'] = 2
             else:
                 return None # skip
 
-        if self.get_column_attribute(loc.col_name, 'stand_out', False):
+        if self._col_stand_out[loc.col_name]:
             builder.classes.append('stand-out')
-            if loc.loc_in_table != loc.LOC_IN_TABLE_HDR:
+            if loc_in_table != _LOC_IN_TABLE_HDR:
                 stand_out_class = self._get_stand_out_class_from_cache(loc)
                 if stand_out_class is not None and stand_out_class != 'muted':
                     builder.classes.append(stand_out_class)
@@ -792,54 +1014,71 @@ $table
         return self.increase_indent() + opening
 
     def end_value(self, loc):
-        if loc.num_of_runs_in_cell <= 0 and loc.num_of_runs_in_group > 0 and loc.n_run > 0:
+        if loc.in_row_span:
             return None
         return self.decrease_indent() + ('</th>' if self.cell_is_th(loc) else '</td>')
 
     def process_value(self, loc):
-        if loc.num_of_runs_in_cell <= 0 and loc.num_of_runs_in_group > 0 and loc.n_run > 0:
+        if loc.in_row_span:
             return None
 
-        value = loc.value
-        if loc.loc_in_table != loc.LOC_IN_TABLE_HDR:
-            formatter = self.get_column_attribute(loc.col_name, 'formatter', None)
+        loc_in_table = loc.loc_in_table
+        if loc_in_table == _LOC_IN_TABLE_FOOTER:
+            if loc.num_of_runs_in_cell <= 0 and loc.n_col == 0:
+                return self._get_value_html(self.footer_names[loc.n_group], None)
+        return self._get_value_html(loc.value, None if loc_in_table == _LOC_IN_TABLE_HDR else loc.col_name)
+
+    def _get_value_html(self, value, col_name):
+        """
+        Applies the formatter of `col_name` to `value` (none if `col_name` is None), and returns the
+        indented and escaped result.
+        """
+        is_safe = False
+        if col_name is not None:
+            formatter = self._col_formatter[col_name]
             if formatter is not None:
                 value = formatter(value)
-        if loc.loc_in_table == loc.LOC_IN_TABLE_FOOTER:
-            if loc.num_of_runs_in_cell <= 0 and loc.n_col == 0:
-                value = self.footer_names[loc.n_group]
+                is_safe = self._col_safe_formatter[col_name]
 
         if value is None:
             return self.indent() + '<span class="text-muted">n/a</span>'
+        elif is_safe or type(value) in _NUMBER_TYPES:
+            # Numbers never contain characters that need escaping
+            return self.indent() + str(value)
         else:
-            return self.indent() + quick_html_escape(str(value))
+            return self.indent() + quick_html_escape(_to_str(value))
+
+    def _get_cell_hooks(self, loc_in_table):
+        value_hooks, delta_hooks = super(HTMLSheetFormatter, self)._get_cell_hooks(loc_in_table)
+        if loc_in_table == _LOC_IN_TABLE_HDR:
+            if all(_is_inherited_method(self, name, HTMLSheetFormatter)
+                   for name in ('begin_delta', 'process_delta', 'end_delta')):
+                # The header has no delta cells
+                delta_hooks = ()
+        return value_hooks, delta_hooks
 
     def begin_delta(self, loc):
-        if not self.column_has_delta(loc.col_name) or loc.loc_in_table == loc.LOC_IN_TABLE_HDR:
-            return None
-        if loc.num_of_runs_in_cell <= 0 and loc.num_of_runs_in_group > 0 and loc.n_run > 0:
+        if not loc.col_has_delta or loc.in_row_span or loc.loc_in_table == _LOC_IN_TABLE_HDR:
             return None
 
-        classes = ['delta']
-        if self.get_column_attribute(loc.col_name, 'stand_out', False):
-            classes.append('stand-out')
+        key = (False, None)
+        if self._col_stand_out[loc.col_name]:
             stand_out_class = self._get_stand_out_class_from_cache(loc)
-            if stand_out_class is not None and stand_out_class != 'muted':
-                classes.append(stand_out_class)
-
-        return self.increase_indent() + TagBuilder.create_tag('td', classes)
+            key = (True, None if stand_out_class == 'muted' else stand_out_class)
+        try:
+            opening = _delta_td_openings[key]
+        except KeyError:
+            # Custom class from an overridden `get_stand_out_class`
+            opening = _delta_td_openings[key] = _create_delta_td_opening(*key)
+        return self.increase_indent() + opening
 
     def end_delta(self, loc):
-        if not self.column_has_delta(loc.col_name) or loc.loc_in_table == loc.LOC_IN_TABLE_HDR:
-            return None
-        if loc.num_of_runs_in_cell <= 0 and loc.num_of_runs_in_group > 0 and loc.n_run > 0:
+        if not loc.col_has_delta or loc.in_row_span or loc.loc_in_table == _LOC_IN_TABLE_HDR:
             return None
         return self.decrease_indent() + '</td>'
 
     def process_delta(self, loc):
-        if not self.column_has_delta(loc.col_name) or loc.loc_in_table == loc.LOC_IN_TABLE_HDR:
-            return None
-        if loc.num_of_runs_in_cell <= 0 and loc.num_of_runs_in_group > 0 and loc.n_run > 0:
+        if not loc.col_has_delta or loc.in_row_span or loc.loc_in_table == _LOC_IN_TABLE_HDR:
             return None
         if loc.n_run == 0:
             return None
@@ -851,29 +1090,44 @@ $table
         else:
             builder.body = body
         if classes is not None:
-            if type(classes) is not list:
-                classes = [classes]
-            builder.classes += classes
+            if isinstance(classes, _STRING_TYPES):
+                builder.classes.append(classes)
+            else:
+                builder.classes.extend(classes)
 
         opening, body, closing = builder.run()
         return self.indent() + opening + body + closing
 
+    def _cache_column_info(self):
+        super(HTMLSheetFormatter, self)._cache_column_info()
+        self._col_bigger_is_better = dict((col_name, self.get_column_attribute(col_name, 'bigger_is_better', False)) for col_name in self.header)
+        self._col_stand_out = dict((col_name, self.get_column_attribute(col_name, 'stand_out', False)) for col_name in self.header)
+        self._col_formatter = dict((col_name, self.get_column_attribute(col_name, 'formatter', None)) for col_name in self.header)
+        self._col_safe_formatter = dict((col_name, self.get_column_attribute(col_name, 'safe_formatter', False)) for col_name in self.header)
+
     def _get_stand_out_class_from_cache(self, loc):
-        key = (loc.n_group, loc.n_run, loc.n_col)
-        if key not in self._stand_out_class_cache:
-            self._stand_out_class_cache[key] = self.get_stand_out_class(loc)
-        return self._stand_out_class_cache[key]
+        # Body and footer groups are both numbered from 0
+        key = (loc.loc_in_table, loc.n_group, loc.n_run, loc.n_col)
+        cache = self._stand_out_class_cache
+        try:
+            return cache[key]
+        except KeyError:
+            stand_out_class = cache[key] = self.get_stand_out_class(loc)
+            return stand_out_class
 
     def increase_indent(self):
         self._indent += 1
-        return ' ' * 4 * (self._indent - 1)
+        n = self._indent - 1
+        return _INDENTS[n] if 0 <= n < _NUM_INDENTS else ' ' * 4 * n
 
     def decrease_indent(self):
         self._indent -= 1
-        return self.indent()
+        n = self._indent
+        return _INDENTS[n] if 0 <= n < _NUM_INDENTS else ' ' * 4 * n
 
     def indent(self):
-        return ' ' * 4 * self._indent
+        n = self._indent
+        return _INDENTS[n] if 0 <= n < _NUM_INDENTS else ' ' * 4 * n
 
     def __init__(self, grouped_runs, footer_with_delta=True, run_names=[], title='HTMLSheetFormatter'):
         super(HTMLSheetFormatter, self).__init__(grouped_runs, footer_with_delta)
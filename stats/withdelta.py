@@ -10,18 +10,23 @@ class withdelta(object):
 
     Use val_of to quickly unwrap any object from its withdelta wrapper.
     """
-    value = None
-    delta = None
+    __slots__ = ('value', 'delta')
+
     def __getattr__(self, name):
-        if name in ['value', 'delta']:
-            return super(withdelta, self).__getattr__(name)
-        else:
-            return getattr(self.value, name)
+        # Only called when the lookup fails, i.e. never for `value` and `delta` once they are set
+        if name == 'value' or name == 'delta':
+            raise AttributeError(name)
+        return getattr(self.value, name)
     def __setattr__(self, name, value):
-        if name in ['value', 'delta']:
-            super(withdelta, self).__setattr__(name, value)
+        if name == 'value' or name == 'delta':
+            object.__setattr__(self, name, value)
         else:
             setattr(self.value, name, value)
+    def __getstate__(self):
+        # Required to pickle a slotted class with protocols 0 and 1
+        return (self.value, self.delta)
+    def __setstate__(self, state):
+        self.value, self.delta = state
     def __repr__(self):
         return 'withdelta(' + str(self.value) + ', ' + str(self.delta) + ')'
     def __init__(self, obj, delta = float('NaN')):
@@ -30,7 +35,8 @@ class withdelta(object):
 
 def val_of(obj):
     """
-    Returns `obj.value` if obj is a withdelta instance, otherwise just obj.
+    Returns `obj.value` if the type of obj is exactly withdelta, otherwise just obj (instances
+    of subclasses of withdelta are not unwrapped).
     """
-    return obj.value if isinstance(obj, withdelta) else obj
+    return obj.value if type(obj) is withdelta else obj
 